@@ -4,42 +4,122 @@ import logging
 import random
 import socket
 import struct
-import sys
-import time
 from abc import ABCMeta, abstractmethod, abstractproperty
 from binascii import hexlify
 
-from ipv8.messaging.deprecated.encoding import add_url_params
 from ipv8.taskmanager import TaskManager
 
 from libtorrent import bdecode
 
 from six import text_type
+from six.moves.urllib.parse import urlencode
 
 from twisted.internet import defer, reactor
 from twisted.internet.defer import Deferred, inlineCallbacks
-from twisted.internet.protocol import DatagramProtocol
-from twisted.web.client import Agent, HTTPConnectionPool, RedirectAgent, readBody
+from twisted.internet.protocol import DatagramProtocol, Protocol
+from twisted.internet.task import deferLater
+from twisted.web.client import Agent, HTTPConnectionPool, RedirectAgent, ResponseDone
 
 from Tribler.Core.Utilities.tracker_utils import parse_tracker_url
 
+# Attempt to import the C implementation of better_bencode
+try:
+    import better_bencode
+    HAS_BETTER_BENCODE = True
+except ImportError:
+    better_bencode = None
+    HAS_BETTER_BENCODE = False
+
 # Although these are the actions for UDP trackers, they can still be used as
 # identifiers.
 TRACKER_ACTION_CONNECT = 0
 TRACKER_ACTION_ANNOUNCE = 1
 TRACKER_ACTION_SCRAPE = 2
 
-MAX_INT32 = 2 ** 16 - 1
+MAX_INT32 = 2 ** 31 - 1
 
 UDP_TRACKER_INIT_CONNECTION_ID = 0x41727101980
 UDP_TRACKER_RECHECK_INTERVAL = 15
 UDP_TRACKER_MAX_RETRIES = 8
+UDP_TRACKER_MAX_RECHECK_INTERVAL = 60
+# How long a client may reuse a connection ID, see BEP 15
+UDP_TRACKER_CONNECTION_ID_LIFETIME = 60
+# how long (in seconds) a resolved tracker hostname, or a failure to resolve it, is remembered
+UDP_TRACKER_DNS_CACHE_LIFETIME = 300
+UDP_TRACKER_DNS_FAILURE_CACHE_LIFETIME = 60
 
 HTTP_TRACKER_RECHECK_INTERVAL = 60
 HTTP_TRACKER_MAX_RETRIES = 0
+HTTP_TRACKER_MAX_RESPONSE_SIZE = 1024 * 1024
 
 MAX_INFOHASHES_IN_SCRAPE = 60
 
+# The minimum time between two requests to the same tracker, to avoid being banned for flooding it
+TRACKER_MIN_REQUEST_INTERVAL = 0.2
+
+# The same trackers are checked over and over again, so we keep the results of parse_tracker_url around.
+_parsed_tracker_urls = {}
+
+# The maximum sizes of the caches in this module, which _store_bounded clears once they are full so they
+# cannot grow without bound in a long-running process.
+MAX_CACHED_CONNECTION_IDS = 4096
+MAX_TRACKER_REQUEST_TIMES = 4096
+MAX_RESOLVED_TRACKER_HOSTS = 4096
+MAX_PARSED_TRACKER_URLS = 4096
+
+# Compiled structs for the fixed-size parts of the UDP tracker messages.
+UDP_REQUEST_HEADER_STRUCT = struct.Struct('!qii')
+UDP_RESPONSE_HEADER_STRUCT = struct.Struct('!ii')
+UDP_CONNECTION_ID_STRUCT = struct.Struct('!q')
+UDP_TRANSACTION_ID_STRUCT = struct.Struct('!i')
+
+# Compiled structs for the size-dependent UDP scrape responses, keyed by the number of infohashes.
+_scrape_response_structs = {}
+
+
+def get_scrape_response_struct(num_infohashes):
+    """
+    Returns the compiled struct that unpacks the (complete, downloaded, incomplete) triples
+    of a UDP scrape response for the given number of infohashes.
+    :param num_infohashes: The number of infohashes in the scrape response.
+    :return: A struct.Struct instance.
+    """
+    scrape_struct = _scrape_response_structs.get(num_infohashes)
+    if scrape_struct is None:
+        scrape_struct = struct.Struct('!' + 'iii' * num_infohashes)
+        _scrape_response_structs[num_infohashes] = scrape_struct
+    return scrape_struct
+
+
+def _store_bounded(registry, key, value, max_size):
+    """
+    Stores a value in a cache dictionary, clearing the dictionary first if a new key would exceed max_size entries.
+    :param registry: The dictionary to store the value in.
+    :param key: The key to store the value under.
+    :param value: The value to store.
+    :param max_size: The maximum number of entries in the dictionary.
+    """
+    if key not in registry and len(registry) >= max_size:
+        registry.clear()
+    registry[key] = value
+
+
+def decode_scrape_response(body):
+    """
+    Decodes the bencoded body of a HTTP scrape response.
+    If available, better_bencode is used since it decodes the nested dictionaries of a scrape response
+    considerably faster than libtorrent.
+    :param body: The bencoded response body.
+    :return: The decoded response, or None if the body could not be decoded.
+    """
+    if not HAS_BETTER_BENCODE:
+        return bdecode(body)
+
+    try:
+        return better_bencode.loads(body)
+    except (TypeError, ValueError):
+        return None
+
 
 def create_tracker_session(tracker_url, timeout, socket_manager, connection_pool=None):
     """
@@ -48,8 +128,12 @@ def create_tracker_session(tracker_url, timeout, socket_manager, connection_pool
     :param timeout: The timeout for the session.
     :return: The tracker session.
     """
-    tracker_type, tracker_address, announce_page = parse_tracker_url(tracker_url)
+    parsed_tracker_url = _parsed_tracker_urls.get(tracker_url)
+    if parsed_tracker_url is None:
+        parsed_tracker_url = parse_tracker_url(tracker_url)
+        _store_bounded(_parsed_tracker_urls, tracker_url, parsed_tracker_url, MAX_PARSED_TRACKER_URLS)
 
+    tracker_type, tracker_address, announce_page = parsed_tracker_url
     if tracker_type == u'udp':
         return UdpTrackerSession(tracker_url, tracker_address, announce_page, timeout, socket_manager)
     return HttpTrackerSession(tracker_url, tracker_address, announce_page, timeout, connection_pool=connection_pool)
@@ -58,6 +142,9 @@ def create_tracker_session(tracker_url, timeout, socket_manager, connection_pool
 class TrackerSession(TaskManager):
     __meta__ = ABCMeta
 
+    # The time at which the last request to a tracker was (or will be) sent, keyed by (tracker type, hostname).
+    _request_times = dict()
+
     def __init__(self, tracker_type, tracker_url, tracker_address, announce_page, timeout):
         super(TrackerSession, self).__init__()
 
@@ -70,6 +157,8 @@ class TrackerSession(TaskManager):
         self._announce_page = announce_page
 
         self._infohash_list = []
+        # set with the same infohashes, for fast membership checks
+        self._infohash_set = set()
         self.result_deferred = None
 
         self._retries = 0
@@ -100,9 +189,10 @@ class TrackerSession(TaskManager):
 
         self.shutdown_task_manager()
         self._infohash_list = None
+        self._infohash_set = None
 
     def has_infohash(self, infohash):
-        return infohash in self._infohash_list
+        return infohash in self._infohash_set
 
     def add_infohash(self, infohash):
         """
@@ -113,12 +203,25 @@ class TrackerSession(TaskManager):
         assert not self.has_infohash(infohash), u"Must not add duplicate requests"
         if len(self._infohash_list) < MAX_INFOHASHES_IN_SCRAPE:
             self._infohash_list.append(infohash)
+            self._infohash_set.add(infohash)
 
     @abstractmethod
     def connect_to_tracker(self):
         """Does some work when a connection has been established."""
         pass
 
+    def reserve_request_slot(self):
+        """
+        Reserves the next moment at which this session may send a request to its tracker.
+        Requests to the same tracker are spaced at least TRACKER_MIN_REQUEST_INTERVAL seconds apart.
+        :return: The number of seconds this session has to wait before sending its request.
+        """
+        tracker_key = (self._tracker_type, self._tracker_address[0])
+        now = reactor.seconds()
+        request_time = max(now, TrackerSession._request_times.get(tracker_key, 0) + TRACKER_MIN_REQUEST_INTERVAL)
+        _store_bounded(TrackerSession._request_times, tracker_key, request_time, MAX_TRACKER_REQUEST_TIMES)
+        return request_time - now
+
     def start_timeout(self):
         self.timeout_call = self.register_task("timeout", reactor.callLater(self.timeout, self.on_timeout)) \
             if self.timeout != 0 else None
@@ -188,15 +291,13 @@ class TrackerSession(TaskManager):
 class HttpTrackerSession(TrackerSession):
     def __init__(self, tracker_url, tracker_address, announce_page, timeout, connection_pool=None):
         super(HttpTrackerSession, self).__init__(u'http', tracker_url, tracker_address, announce_page, timeout)
-        self._header_buffer = None
-        self._message_buffer = None
-        self._content_encoding = None
-        self._content_length = None
-        self._received_length = None
-        self.result_deferred = None
-        self._parse_deferred = None
         self.request = None
+        # A shared connection pool is owned (and closed) by its creator, we only close a pool we created ourselves.
+        self._owns_connection_pool = connection_pool is None
         self._connection_pool = connection_pool if connection_pool else HTTPConnectionPool(reactor, False)
+        # the scrape URL without the infohashes, which only have to be appended to it
+        self._scrape_url_prefix = u"http://%s:%s%s?" % (tracker_address[0], tracker_address[1],
+                                                        announce_page.replace(u'announce', u'scrape'))
 
     def max_retries(self):
         """
@@ -212,25 +313,27 @@ class HttpTrackerSession(TrackerSession):
         """
         return HTTP_TRACKER_RECHECK_INTERVAL
 
-    def connect_to_tracker(self):
-        # create the HTTP GET message
-        # Note: some trackers have strange URLs, e.g.,
-        #       http://moviezone.ws/announce.php?passkey=8ae51c4b47d3e7d0774a720fa511cc2a
-        #       which has some sort of 'key' as parameter, so we need to use the add_url_params
-        #       utility function to handle such cases.
-
-        url = add_url_params("http://%s:%s%s" %
-                             (self._tracker_address[0], self._tracker_address[1],
-                              self._announce_page.replace(u'announce', u'scrape')),
-                             {"info_hash": self._infohash_list})
+    def _get_scrape_url(self):
+        """
+        Returns the scrape URL for the infohashes in this session.
+        :return: The scrape URL.
+        """
+        return self._scrape_url_prefix + urlencode({"info_hash": self._infohash_list}, doseq=True)
 
+    def connect_to_tracker(self):
         # no more requests can be appended to this session
         self._is_initiated = True
-        self._last_contact = int(time.time())
+        self._last_contact = int(reactor.seconds())
 
         agent = RedirectAgent(Agent(reactor, connectTimeout=self.timeout, pool=self._connection_pool))
         try:
-            self.request = self.register_task("request", agent.request('GET', bytes(url)))
+            # create the HTTP GET message
+            url = self._get_scrape_url().encode('ascii')
+            delay = self.reserve_request_slot()
+            if delay > 0:
+                self.request = self.register_task("request", deferLater(reactor, delay, agent.request, 'GET', url))
+            else:
+                self.request = self.register_task("request", agent.request('GET', url))
             self.request.addCallback(self.on_response)
             self.request.addErrback(self.on_error)
             self._logger.debug(u"%s HTTP SCRAPE message sent: %s", self, url)
@@ -261,8 +364,10 @@ class HttpTrackerSession(TrackerSession):
             return
 
         # All ok, parse the body
-        self._parse_deferred = readBody(response).addCallbacks(self._process_scrape_response, self.on_error)
-        self.register_task("parse_body", self._parse_deferred)
+        body_protocol = ScrapeBodyProtocol(HTTP_TRACKER_MAX_RESPONSE_SIZE)
+        response.deliverBody(body_protocol)
+        self.register_task("parse_body",
+                           body_protocol.finished.addCallbacks(self._process_scrape_response, self.on_error))
 
     def _on_cancel(self, _):
         """
@@ -296,38 +401,33 @@ class HttpTrackerSession(TrackerSession):
             self.failed(msg="no response body")
             return
 
-        response_dict = bdecode(body)
-        if not response_dict:
+        response_dict = decode_scrape_response(body)
+        if not isinstance(response_dict, dict) or not response_dict:
             self.failed(msg="no valid response")
             return
 
         response_list = []
 
-        unprocessed_infohash_list = self._infohash_list[:]
-        if 'files' in response_dict and isinstance(response_dict['files'], dict):
-            for infohash in response_dict['files']:
-                complete = response_dict['files'][infohash].get('complete', 0)
-                incomplete = response_dict['files'][infohash].get('incomplete', 0)
-
-                # Sow complete as seeders. "complete: number of peers with the entire file, i.e. seeders (integer)"
-                #  - https://wiki.theory.org/BitTorrentSpecification#Tracker_.27scrape.27_Convention
-                seeders = complete
-                leechers = incomplete
-
-                # Store the information in the dictionary
-                response_list.append({'infohash': hexlify(infohash), 'seeders': seeders, 'leechers': leechers})
-
-                # remove this infohash in the infohash list of this session
-                if infohash in unprocessed_infohash_list:
-                    unprocessed_infohash_list.remove(infohash)
+        files = response_dict.get('files')
+        if isinstance(files, dict):
+            # Sow complete as seeders. "complete: number of peers with the entire file, i.e. seeders (integer)"
+            #  - https://wiki.theory.org/BitTorrentSpecification#Tracker_.27scrape.27_Convention
+            response_list = [{'infohash': hexlify(infohash),
+                              'seeders': file_info.get('complete', 0),
+                              'leechers': file_info.get('incomplete', 0)}
+                             for infohash, file_info in files.items()]
 
         elif 'failure reason' in response_dict:
-            self._logger.info(u"%s Failure as reported by tracker [%s]", self, repr(response_dict['failure reason']))
-            self.failed(msg=repr(response_dict['failure reason']))
+            failure_reason = repr(response_dict['failure reason'])
+            self._logger.info(u"%s Failure as reported by tracker [%s]", self, failure_reason)
+            self.failed(msg=failure_reason)
             return
 
+        else:
+            files = {}
+
         # handle the infohashes with no result (seeders/leechers = 0/0)
-        for infohash in unprocessed_infohash_list:
+        for infohash in self._infohash_set.difference(files):
             response_list.append({'infohash': hexlify(infohash), 'seeders': 0, 'leechers': 0})
 
         self._is_finished = True
@@ -340,19 +440,58 @@ class HttpTrackerSession(TrackerSession):
         Cleans the session by cancelling all deferreds and closing sockets.
         :return: A deferred that fires once the cleanup is done.
         """
-        yield self._connection_pool.closeCachedConnections()
+        if self._owns_connection_pool:
+            yield self._connection_pool.closeCachedConnections()
         yield super(HttpTrackerSession, self).cleanup()
 
-        # If we are in the process of reading a HTTP response from a remote server (with the readBody) method, it might
-        # be that it is called after the deferred has been cancelled already (by the super.cleanup method). This would
-        # result in an AlreadyCalled error. The following line prevents this behaviour.
-        if self._parse_deferred:
-            self._parse_deferred._suppressAlreadyCalled = True
-
         self.request = None
         self.result_deferred = None
 
 
+class ScrapeBodyProtocol(Protocol):
+    """
+    The ScrapeBodyProtocol collects the body of a HTTP scrape response.
+    Some trackers ignore the requested infohashes and return the statistics of all their torrents in one
+    (possibly huge) response. To bound the memory used per session, the download is aborted once the body
+    exceeds a maximum size.
+    """
+
+    def __init__(self, max_size):
+        self.finished = Deferred(self._on_cancel)
+        self.max_size = max_size
+        self.received_size = 0
+        self.data_buffer = []
+
+    def _on_cancel(self, _):
+        """
+        Stops downloading the body when the finished deferred is cancelled.
+        """
+        if self.transport:
+            self.transport.stopProducing()
+
+    def dataReceived(self, data):
+        if self.finished.called:
+            return
+
+        self.received_size += len(data)
+        if self.received_size > self.max_size:
+            self.data_buffer = []
+            self.finished.errback(ValueError("response body larger than %d bytes" % self.max_size))
+            self.transport.stopProducing()
+            return
+
+        self.data_buffer.append(data)
+
+    def connectionLost(self, reason):
+        if self.finished.called:
+            return
+
+        if reason.check(ResponseDone):
+            self.finished.callback(b''.join(self.data_buffer))
+        else:
+            self.finished.errback(reason)
+
+
 class UdpSocketManager(DatagramProtocol):
     """
     The UdpSocketManager ensures that the network packets are forwarded to the right UdpTrackerSession.
@@ -371,11 +510,12 @@ class UdpSocketManager(DatagramProtocol):
                                  tracker_session.ip_address, tracker_session.port, exc)
 
     def datagramReceived(self, data, _):
-        # If the incoming data is valid, find the tracker session and give it the data
-        if data and len(data) >= 4:
-            transaction_id = struct.unpack_from('!i', data, 4)[0]
-            if transaction_id in self.tracker_sessions:
-                self.tracker_sessions.pop(transaction_id).handle_response(data)
+        # If the incoming data is valid, find the tracker session and give it the data.
+        # Every tracker response starts with the action and transaction ID, 8 bytes in total.
+        if data and len(data) >= 8:
+            tracker_session = self.tracker_sessions.pop(UDP_TRANSACTION_ID_STRUCT.unpack_from(data, 4)[0], None)
+            if tracker_session is not None:
+                tracker_session.handle_response(data)
 
 
 class UdpTrackerSession(TrackerSession):
@@ -383,29 +523,55 @@ class UdpTrackerSession(TrackerSession):
     The UDPTrackerSession makes a connection with a UDP tracker and queries
     seeders and leechers for one or more infohashes. It handles the message serialization
     and communication with the torrent checker by making use of Deferred (asynchronously).
+
+    A session only waits on two kinds of I/O: resolving the tracker hostname and the tracker responses,
+    which the UdpSocketManager hands to handle_response. The latter is a two-state machine: it expects
+    a connection response first and a scrape response afterwards.
     """
 
     # A list of transaction IDs that have been used in order to avoid conflict.
     _active_session_dict = dict()
-    reactor = reactor
+    # The transaction IDs in _active_session_dict, for fast uniqueness checks.
+    _active_transaction_ids = set()
+    # The connection IDs handed out by trackers, mapping (ip address, port) to (connection ID, expiration time).
+    # Sessions to the same tracker reuse a connection ID while it is valid, which saves a connect round trip.
+    _connection_ids = dict()
+    # The resolved tracker hostnames, mapping hostname to (ip address, expiration time, error message).
+    # The ip address is None if resolving failed, so broken trackers are not looked up over and over again.
+    _resolved_hosts = dict()
 
     def __init__(self, tracker_url, tracker_address, announce_page, timeout, socket_mgr):
         super(UdpTrackerSession, self).__init__(u'udp', tracker_url, tracker_address, announce_page, timeout)
 
         self._logger.setLevel(logging.INFO)
-        self._connection_id = 0
         self.transaction_id = 0
         self.port = tracker_address[1]
         self.ip_address = None
         self.expect_connection_response = True
         self.socket_mgr = socket_mgr
         self.ip_resolve_deferred = None
+        # the last message we sent, which is retransmitted if the tracker does not respond in time
+        self._last_message = None
+        # whether we skipped the connection phase by reusing the connection ID of an earlier session
+        self._reused_connection_id = False
+        # the concatenated infohashes of this session, as they appear in a scrape request
+        self._infohash_buffer = bytearray()
 
         # prepare connection message
         self._connection_id = UDP_TRACKER_INIT_CONNECTION_ID
         self.action = TRACKER_ACTION_CONNECT
         self.generate_transaction_id()
 
+    def add_infohash(self, infohash):
+        """
+        Adds an infohash into this session.
+        :param infohash: The infohash to be added.
+        """
+        num_infohashes = len(self._infohash_list)
+        super(UdpTrackerSession, self).add_infohash(infohash)
+        if len(self._infohash_list) > num_infohashes:
+            self._infohash_buffer.extend(infohash)
+
     def on_error(self, failure):
         """
         Handles the case when resolving an ip address fails.
@@ -427,13 +593,18 @@ class UdpTrackerSession(TrackerSession):
     def on_ip_address_resolved(self, ip_address, start_scraper=True):
         """
         Called when a hostname has been resolved to an ip address.
-        Constructs a scraper and opens a UDP port to listen on.
-        Removes an old scraper if present.
+        Sends the connection request to the tracker through the shared socket manager.
         :param ip_address: The ip address that matches the hostname of the tracker_url.
-        :param start_scraper: Whether we should start the scraper immediately.
+        :param start_scraper: Unused, kept for backwards compatibility.
         """
         self.ip_address = ip_address
-        self.connect()
+
+        delay = self.reserve_request_slot()
+        if delay > 0:
+            self.cancel_pending_task("connect")
+            self.register_task("connect", reactor.callLater(delay, self.connect))
+        else:
+            self.connect()
 
     def failed(self, msg=None):
         """
@@ -447,18 +618,22 @@ class UdpTrackerSession(TrackerSession):
             self.result_deferred.errback(ValueError(result_msg))
 
         self._is_failed = True
+        self.cancel_pending_task("retransmit")
 
     def generate_transaction_id(self):
         """
         Generates a unique transaction id and stores this in the _active_session_dict set.
         """
-        while True:
-            # make sure there is no duplicated transaction IDs
-            transaction_id = random.randint(0, MAX_INT32)
-            if transaction_id not in UdpTrackerSession._active_session_dict.items():
-                UdpTrackerSession._active_session_dict[self] = transaction_id
-                self.transaction_id = transaction_id
-                break
+        # make sure there is no duplicated transaction IDs (transaction IDs are in the range [0, MAX_INT32])
+        transaction_id = random.getrandbits(31)
+        while transaction_id in UdpTrackerSession._active_transaction_ids:
+            transaction_id = random.getrandbits(31)
+
+        # release the transaction ID this session used before
+        UdpTrackerSession._active_transaction_ids.discard(UdpTrackerSession._active_session_dict.get(self))
+        UdpTrackerSession._active_transaction_ids.add(transaction_id)
+        UdpTrackerSession._active_session_dict[self] = transaction_id
+        self.transaction_id = transaction_id
 
     def remove_transaction_id(self):
         """
@@ -466,7 +641,7 @@ class UdpTrackerSession(TrackerSession):
         :param session: The session that needs to be removed from the set.
         """
         if self in UdpTrackerSession._active_session_dict:
-            del UdpTrackerSession._active_session_dict[self]
+            UdpTrackerSession._active_transaction_ids.discard(UdpTrackerSession._active_session_dict.pop(self))
 
         # Checking for socket_mgr is a workaround for race condition
         # in Tribler Session startup/shutdown that sometimes causes
@@ -501,10 +676,10 @@ class UdpTrackerSession(TrackerSession):
     def retry_interval(self):
         """
         Returns the time one has to wait until retrying the connection again.
-        Increases exponentially with the number of retries.
+        Increases exponentially with the number of retries, up to UDP_TRACKER_MAX_RECHECK_INTERVAL.
         :return: The interval one has to wait before retrying the connection.
         """
-        return UDP_TRACKER_RECHECK_INTERVAL * (2 ** self._retries)
+        return min(UDP_TRACKER_RECHECK_INTERVAL * (2 ** self._retries), UDP_TRACKER_MAX_RECHECK_INTERVAL)
 
     def connect_to_tracker(self):
         """
@@ -516,19 +691,68 @@ class UdpTrackerSession(TrackerSession):
 
         self.start_timeout()
 
-        # clean old deferreds if present
-        self.cancel_pending_task("result")
+        self._last_contact = int(reactor.seconds())
+
+        # the result deferred has to exist before resolving, since a cached address is handled right away
+        self.result_deferred = Deferred(self._on_cancel)
+
+        # clean an old resolve deferred if present
         self.cancel_pending_task("resolve")
 
+        hostname = self._tracker_address[0]
+        cached = UdpTrackerSession._resolved_hosts.get(hostname)
+        if cached and cached[1] > reactor.seconds():
+            ip_address, _, error_message = cached
+            if ip_address is None:
+                self.failed(msg=error_message)
+            else:
+                self.on_ip_address_resolved(ip_address)
+            return self.result_deferred
+
         # Resolve the hostname to an IP address if not done already
-        self.ip_resolve_deferred = self.register_task("resolve", reactor.resolve(self._tracker_address[0]))
+        self.ip_resolve_deferred = self.register_task("resolve", reactor.resolve(hostname))
+        self.ip_resolve_deferred.addCallbacks(self.on_host_resolved, self.on_host_resolve_failed,
+                                              callbackArgs=(hostname,), errbackArgs=(hostname,))
         self.ip_resolve_deferred.addCallbacks(self.on_ip_address_resolved, self.on_error)
 
-        self._last_contact = int(time.time())
-
-        self.result_deferred = Deferred(self._on_cancel)
         return self.result_deferred
 
+    @staticmethod
+    def on_host_resolved(ip_address, hostname):
+        """
+        Remembers the ip address of a resolved tracker hostname.
+        :param ip_address: The ip address that matches the hostname.
+        :param hostname: The hostname that was resolved.
+        :return: The ip address, for the next callback.
+        """
+        UdpTrackerSession.cache_resolved_host(hostname, ip_address, UDP_TRACKER_DNS_CACHE_LIFETIME)
+        return ip_address
+
+    @staticmethod
+    def on_host_resolve_failed(failure, hostname):
+        """
+        Remembers that a tracker hostname could not be resolved, unless the lookup was cancelled.
+        :param failure: The failure object thrown by the deferred.
+        :param hostname: The hostname that was resolved.
+        :return: The failure, for the next errback.
+        """
+        if not failure.check(defer.CancelledError):
+            UdpTrackerSession.cache_resolved_host(hostname, None, UDP_TRACKER_DNS_FAILURE_CACHE_LIFETIME,
+                                                  failure.getErrorMessage())
+        return failure
+
+    @staticmethod
+    def cache_resolved_host(hostname, ip_address, lifetime, error_message=None):
+        """
+        Stores the outcome of resolving a tracker hostname.
+        :param hostname: The hostname that was resolved.
+        :param ip_address: The ip address that matches the hostname, or None if resolving failed.
+        :param lifetime: The number of seconds the outcome may be used.
+        :param error_message: The reason resolving failed, if it did.
+        """
+        _store_bounded(UdpTrackerSession._resolved_hosts, hostname,
+                       (ip_address, reactor.seconds() + lifetime, error_message), MAX_RESOLVED_TRACKER_HOSTS)
+
     def connect(self):
         """
         Creates a connection message and calls the socket manager to send it.
@@ -537,14 +761,68 @@ class UdpTrackerSession(TrackerSession):
             self.failed(msg="UDP socket transport not ready")
             return
 
+        # Skip the connection phase if another session obtained a connection ID from this tracker recently
+        connection_id, expiration_time = UdpTrackerSession._connection_ids.get((self.ip_address, self.port),
+                                                                               (None, 0))
+        if expiration_time > reactor.seconds():
+            self._connection_id = connection_id
+            self._reused_connection_id = True
+            self.action = TRACKER_ACTION_SCRAPE
+            self.expect_connection_response = False
+            self.send_scrape_request()
+            return
+
         # Initiate the connection
-        message = struct.pack('!qii', self._connection_id, self.action, self.transaction_id)
+        message = UDP_REQUEST_HEADER_STRUCT.pack(self._connection_id, self.action, self.transaction_id)
+        self.send_message(message)
+
+    def reconnect(self):
+        """
+        Forgets the reused connection ID of this tracker and starts over with the connection phase.
+        """
+        UdpTrackerSession._connection_ids.pop((self.ip_address, self.port), None)
+        self._reused_connection_id = False
+        self._connection_id = UDP_TRACKER_INIT_CONNECTION_ID
+        self.action = TRACKER_ACTION_CONNECT
+        self.expect_connection_response = True
+        self.generate_transaction_id()
+        self.connect()
+
+    def send_message(self, message):
+        """
+        Sends a message to the tracker and schedules its retransmission, in case the tracker does not respond.
+        The retransmission interval is randomized so retransmissions to a tracker are spread out.
+        :param message: The message to send.
+        """
+        self._last_message = message
         self.socket_mgr.send_request(message, self)
 
+        self.cancel_pending_task("retransmit")
+        self.register_task("retransmit", reactor.callLater(self.retry_interval() * (0.5 + random.random()),
+                                                           self.on_retransmit))
+
+    def on_retransmit(self):
+        """
+        Executed when the tracker did not respond to our last message in time.
+        Sends the message again, or fails the session once the maximum number of retries has been reached.
+        """
+        if self._is_failed or self._is_finished:
+            return
+
+        if self._retries >= self.max_retries():
+            self.failed(msg="no response after %d retries" % self._retries)
+            return
+
+        self.increase_retries()
+        self._logger.debug(u"%s No response from tracker, retry %d", self, self._retries)
+        self.send_message(self._last_message)
+
     def handle_response(self, response):
         if self.is_failed:
             return
 
+        self.cancel_pending_task("retransmit")
+
         if self.expect_connection_response:
             if self.timeout_call and self.timeout_call.active():
                 self.timeout_call.cancel()
@@ -562,40 +840,43 @@ class UdpTrackerSession(TrackerSession):
         """
         # check message size
         if len(response) < 16:
-            self._logger.error(u"%s Invalid response for UDP CONNECT: %s", self, repr(response))
+            self._logger.error(u"%s Invalid response for UDP CONNECT: %r", self, response)
             self.failed(msg="invalid response size")
             return
 
         # check the response
-        action, transaction_id = struct.unpack_from('!ii', response, 0)
+        action, transaction_id = UDP_RESPONSE_HEADER_STRUCT.unpack_from(response, 0)
         if action != self.action or transaction_id != self.transaction_id:
             # get error message
-            errmsg_length = len(response) - 8
-            error_message = struct.unpack_from('!' + str(errmsg_length) + 's', response, 8)
+            error_message = response[8:]
 
-            self._logger.info(u"%s Error response for UDP CONNECT [%s]: %s",
-                              self, repr(response), repr(error_message))
-            self.failed(msg=''.join(error_message))
+            self._logger.info(u"%s Error response for UDP CONNECT [%r]: %r", self, response, error_message)
+            self.failed(msg=error_message)
             return
 
         # update action and IDs
-        self._connection_id = struct.unpack_from('!q', response, 8)[0]
+        self._connection_id = UDP_CONNECTION_ID_STRUCT.unpack_from(response, 8)[0]
+        if self.ip_address:
+            _store_bounded(UdpTrackerSession._connection_ids, (self.ip_address, self.port),
+                           (self._connection_id, reactor.seconds() + UDP_TRACKER_CONNECTION_ID_LIFETIME),
+                           MAX_CACHED_CONNECTION_IDS)
         self.action = TRACKER_ACTION_SCRAPE
         self.generate_transaction_id()
 
-        # pack and send the message
-        if sys.version_info.major > 2:
-            infohash_list = self._infohash_list
-        else:
-            infohash_list = [str(infohash) for infohash in self._infohash_list]
+        self.send_scrape_request()
 
-        fmt = '!qii' + ('20s' * len(self._infohash_list))
-        message = struct.pack(fmt, self._connection_id, self.action, self.transaction_id, *infohash_list)
+    def send_scrape_request(self):
+        """
+        Queries the tracker for seed/leech data of the infohashes in this session.
+        """
+        # pack and send the message, the infohashes are already laid out back to back in the infohash buffer
+        message = UDP_REQUEST_HEADER_STRUCT.pack(self._connection_id, self.action, self.transaction_id) \
+            + bytes(self._infohash_buffer)
 
         # Send the scrape message
-        self.socket_mgr.send_request(message, self)
+        self.send_message(message)
 
-        self._last_contact = int(time.time())
+        self._last_contact = int(reactor.seconds())
 
     def handle_scrape_response(self, response):
         """
@@ -604,20 +885,24 @@ class UdpTrackerSession(TrackerSession):
         """
         # check message size
         if len(response) < 8:
-            self._logger.info(u"%s Invalid response for UDP SCRAPE: %s", self, repr(response))
+            self._logger.info(u"%s Invalid response for UDP SCRAPE: %r", self, response)
             self.failed("invalid message size")
             return
 
         # check response
-        action, transaction_id = struct.unpack_from('!ii', response, 0)
+        action, transaction_id = UDP_RESPONSE_HEADER_STRUCT.unpack_from(response, 0)
         if action != self.action or transaction_id != self.transaction_id:
             # get error message
-            errmsg_length = len(response) - 8
-            error_message = struct.unpack_from('!' + str(errmsg_length) + 's', response, 8)
+            error_message = response[8:]
 
-            self._logger.info(u"%s Error response for UDP SCRAPE: [%s] [%s]",
-                              self, repr(response), repr(error_message))
-            self.failed(msg=''.join(error_message))
+            self._logger.info(u"%s Error response for UDP SCRAPE: [%r] [%r]", self, response, error_message)
+
+            if self._reused_connection_id:
+                # The tracker might not accept the reused connection ID anymore, fall back to a regular connect
+                self.reconnect()
+                return
+
+            self.failed(msg=error_message)
             return
 
         # get results
@@ -626,21 +911,18 @@ class UdpTrackerSession(TrackerSession):
             self.failed(msg="invalid response size")
             return
 
-        offset = 8
-
-        response_list = []
+        # Parse all (complete, downloaded, incomplete) triples in one go.
+        values = get_scrape_response_struct(len(self._infohash_list)).unpack_from(response, 8)
 
-        for infohash in self._infohash_list:
-            complete, _downloaded, incomplete = struct.unpack_from('!iii', response, offset)
-            offset += 12
-
-            # Store the information in the hash dict to be returned.
-            # Sow complete as seeders. "complete: number of peers with the entire file, i.e. seeders (integer)"
-            #  - https://wiki.theory.org/BitTorrentSpecification#Tracker_.27scrape.27_Convention
-            response_list.append({'infohash': hexlify(infohash), 'seeders': complete, 'leechers': incomplete})
+        # Store the information in the hash dict to be returned.
+        # Sow complete as seeders. "complete: number of peers with the entire file, i.e. seeders (integer)"
+        #  - https://wiki.theory.org/BitTorrentSpecification#Tracker_.27scrape.27_Convention
+        response_list = [{'infohash': hexlify(infohash), 'seeders': complete, 'leechers': incomplete}
+                         for infohash, complete, incomplete in zip(self._infohash_list, values[0::3], values[2::3])]
 
         # close this socket and remove its transaction ID from the list
         self.remove_transaction_id()
+        self.cancel_pending_task("retransmit")
         self._is_finished = True
 
         if self.result_deferred and not self.result_deferred.called:
@@ -665,6 +947,7 @@ class FakeDHTSession(TrackerSession):
         :return: A deferred that fires once the cleanup is done.
         """
         self._infohash_list = None
+        self._infohash_set = None
         self._session = None
         # Return a defer that immediately calls its callback
         return defer.succeed(None)
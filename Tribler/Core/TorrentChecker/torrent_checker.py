@@ -30,6 +30,7 @@ TRACKER_SELECTION_INTERVAL = 20    # The interval for querying a random tracker
 TORRENT_SELECTION_INTERVAL = 120   # The interval for checking the health of a random torrent
 MIN_TORRENT_CHECK_INTERVAL = 900   # How much time we should wait before checking a torrent again
 TORRENT_CHECK_RETRY_INTERVAL = 30  # Interval when the torrent was successfully checked for the last time
+HTTP_TRACKER_MAX_PERSISTENT_CONNECTIONS = 2  # The number of cached connections per HTTP tracker
 
 
 class TorrentChecker(TaskManager):
@@ -59,7 +60,9 @@ class TorrentChecker(TaskManager):
     def initialize(self):
         self.tracker_check_lc.start(TRACKER_SELECTION_INTERVAL, now=False)
         self.torrent_check_lc.start(TORRENT_SELECTION_INTERVAL, now=False)
-        self.connection_pool = HTTPConnectionPool(reactor, False)
+        # Keep connections to HTTP trackers open so subsequent scrapes can reuse them.
+        self.connection_pool = HTTPConnectionPool(reactor, True)
+        self.connection_pool.maxPersistentPerHost = HTTP_TRACKER_MAX_PERSISTENT_CONNECTIONS
         self.socket_mgr = UdpSocketManager()
         self.create_socket_or_schedule()
 
@@ -5,12 +5,17 @@ from binascii import hexlify
 
 from libtorrent import bencode
 
-from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, inlineCallbacks, succeed
 from twisted.python.failure import Failure
+from twisted.web.client import ResponseDone
 
+import Tribler.Core.TorrentChecker.session as session_module
 from Tribler.Core.Config.tribler_config import TriblerConfig
 from Tribler.Core.Session import Session
-from Tribler.Core.TorrentChecker.session import FakeDHTSession, HttpTrackerSession, UdpTrackerSession
+from Tribler.Core.TorrentChecker.session import TRACKER_ACTION_CONNECT, TRACKER_ACTION_SCRAPE, \
+    TRACKER_MIN_REQUEST_INTERVAL, UDP_TRACKER_INIT_CONNECTION_ID, FakeDHTSession, HttpTrackerSession, \
+    ScrapeBodyProtocol, TrackerSession, UdpSocketManager, UdpTrackerSession, decode_scrape_response
 from Tribler.Test.Core.base_test import MockObject, TriblerCoreTest
 from Tribler.Test.test_as_server import TestAsServer
 from Tribler.Test.tools import trial_timeout
@@ -35,6 +40,9 @@ class TestTorrentCheckerSession(TestAsServer):
         self.mock_transport = MockObject()
         self.mock_transport.write = lambda *_: None
         self.socket_mgr = FakeUdpSocketManager()
+        UdpTrackerSession._connection_ids.clear()
+        UdpTrackerSession._resolved_hosts.clear()
+        TrackerSession._request_times.clear()
 
     def test_httpsession_scrape_no_body(self):
         session = HttpTrackerSession("localhost", ("localhost", 8475), "/announce", 5)
@@ -48,6 +56,15 @@ class TestTorrentCheckerSession(TestAsServer):
         session._process_scrape_response(bencode({}))
         self.assertTrue(session.is_failed)
 
+    def test_httpsession_response_not_a_dict(self):
+        """
+        Test whether a body that does not decode to a dictionary fails the session
+        """
+        session = HttpTrackerSession("localhost", ("localhost", 8475), "/announce", 5)
+        session._infohash_list = []
+        session._process_scrape_response(bencode([1]))
+        self.assertTrue(session.is_failed)
+
     @trial_timeout(5)
     def test_httpsession_on_error(self):
         test_deferred = Deferred()
@@ -56,6 +73,53 @@ class TestTorrentCheckerSession(TestAsServer):
         session.on_error(Failure(RuntimeError(u"test\xf8\xf9")))
         return test_deferred
 
+    def test_decode_scrape_response(self):
+        files = {"a" * 20: {"complete": 10, "incomplete": 5}}
+        self.assertEqual(decode_scrape_response(bencode({"files": files})), {"files": files})
+
+    def test_httpsession_better_bencode_fails(self):
+        """
+        Test whether a body that better_bencode cannot decode fails the session
+        """
+        def on_loads(_):
+            raise ValueError("invalid bencoding")
+
+        fake_better_bencode = MockObject()
+        fake_better_bencode.loads = on_loads
+        self.patch(session_module, 'HAS_BETTER_BENCODE', True)
+        self.patch(session_module, 'better_bencode', fake_better_bencode)
+
+        errors = []
+        session = HttpTrackerSession("localhost", ("localhost", 8475), "/announce", 5)
+        session._infohash_list = []
+        session.result_deferred = Deferred().addErrback(lambda failure: errors.append(failure.getErrorMessage()))
+        session._process_scrape_response(bencode({"files": {}}))
+
+        self.assertTrue(session.is_failed)
+        self.assertIn("no valid response", errors[0])
+
+    def test_scrape_body_protocol(self):
+        protocol = ScrapeBodyProtocol(10)
+        protocol.dataReceived("abc")
+        protocol.dataReceived("def")
+        protocol.connectionLost(Failure(ResponseDone()))
+        return protocol.finished.addCallback(lambda body: self.assertEqual(body, "abcdef"))
+
+    def test_scrape_body_protocol_too_large(self):
+        protocol = ScrapeBodyProtocol(4)
+        protocol.transport = MockObject()
+        protocol.transport.stopped = False
+
+        def on_stop_producing():
+            protocol.transport.stopped = True
+
+        protocol.transport.stopProducing = on_stop_producing
+        protocol.dataReceived("abc")
+        protocol.dataReceived("def")
+        self.assertTrue(protocol.transport.stopped)
+        protocol.connectionLost(Failure(ResponseDone()))
+        return self.assertFailure(protocol.finished, ValueError)
+
     def test_httpsession_code_not_200(self):
         session = HttpTrackerSession("localhost", ("localhost", 8475), "/announce", 5)
 
@@ -72,10 +136,16 @@ class TestTorrentCheckerSession(TestAsServer):
         session._process_scrape_response(bencode({'failure reason': 'test'}))
         self.assertTrue(session.is_failed)
 
+    def test_httpsession_scrape_url(self):
+        session = HttpTrackerSession("localhost", ("localhost", 8475), "/announce", 5)
+        session.add_infohash("a" * 20)
+        session.add_infohash("\x01" * 20)
+        self.assertEqual(session._get_scrape_url(),
+                         u"http://localhost:8475/scrape?info_hash=%s&info_hash=%s" % ("a" * 20, "%01" * 20))
+
     @trial_timeout(5)
     def test_httpsession_unicode_err(self):
-        session = HttpTrackerSession("retracker.local", ("retracker.local", 80),
-                                     u"/announce?comment=%26%23%3B%28%2C%29%5B%5D%E3%5B%D4%E8%EB%FC%EC%EE%E2", 5)
+        session = HttpTrackerSession("retracker.local", ("retracker.local", 80), u"/announce\xe3\xd4\xe8", 5)
 
         test_deferred = Deferred()
 
@@ -143,6 +213,24 @@ class TestTorrentCheckerSession(TestAsServer):
         session.connect_to_tracker().addErrback(on_error)
         return test_deferred
 
+    @trial_timeout(5)
+    @inlineCallbacks
+    def test_httpsession_shared_pool_not_closed(self):
+        """
+        Test whether the cleanup of a HTTP session leaves a connection pool it did not create open
+        """
+        pool = MockObject()
+        pool.closed = False
+
+        def on_close_cached_connections():
+            pool.closed = True
+            return succeed(None)
+
+        pool.closeCachedConnections = on_close_cached_connections
+        session = HttpTrackerSession("localhost", ("localhost", 8475), "/announce", 5, connection_pool=pool)
+        yield session.cleanup()
+        self.assertFalse(pool.closed)
+
     @trial_timeout(5)
     def test_httpsession_cancel_operation(self):
         test_deferred = Deferred()
@@ -180,6 +268,98 @@ class TestTorrentCheckerSession(TestAsServer):
         session.connect()
         self.assertTrue(session.is_failed)
 
+    @trial_timeout(5)
+    def test_udpsession_retransmit(self):
+        """
+        Test whether a UDP session retransmits its last message and fails after the maximum number of retries
+        """
+        sent_messages = []
+        self.socket_mgr.send_request = lambda message, _: sent_messages.append(message)
+        session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
+        session.result_deferred = Deferred().addErrback(lambda _: None)
+        session.on_ip_address_resolved("127.0.0.1")
+        self.assertEqual(len(sent_messages), 1)
+        self.assertTrue(session.is_pending_task_active("retransmit"))
+
+        session.on_retransmit()
+        self.assertEqual(sent_messages, [sent_messages[0]] * 2)
+        self.assertEqual(session.retries, 1)
+
+        session._retries = session.max_retries()
+        session.on_retransmit()
+        self.assertEqual(len(sent_messages), 2)
+        self.assertTrue(session.is_failed)
+        self.assertFalse(session.is_pending_task_active("retransmit"))
+        return session.cleanup()
+
+    def test_udpsession_reuse_connection_id(self):
+        """
+        Test whether a UDP session skips the connection phase if a connection ID for the tracker is known
+        """
+        sent_messages = []
+        self.socket_mgr.send_request = lambda message, _: sent_messages.append(message)
+        session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
+        session.on_ip_address_resolved("127.0.0.1")
+        session.handle_response(struct.pack("!iiq", session.action, session.transaction_id, 126))
+        self.assertEqual(len(sent_messages), 2)
+
+        TrackerSession._request_times.clear()
+        other_session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
+        other_session.on_ip_address_resolved("127.0.0.1")
+        self.assertEqual(len(sent_messages), 3)
+        self.assertEqual(struct.unpack_from("!qii", sent_messages[2]),
+                         (126, TRACKER_ACTION_SCRAPE, other_session.transaction_id))
+        self.assertFalse(other_session.expect_connection_response)
+
+        # If the tracker rejects the reused connection ID, the session should connect again
+        other_session.handle_response(struct.pack("!ii5s", 3, other_session.transaction_id, "error"))
+        self.assertFalse(other_session.is_failed)
+        self.assertTrue(other_session.expect_connection_response)
+        self.assertEqual(len(sent_messages), 4)
+        self.assertEqual(struct.unpack_from("!qii", sent_messages[3]),
+                         (UDP_TRACKER_INIT_CONNECTION_ID, TRACKER_ACTION_CONNECT, other_session.transaction_id))
+
+        return DeferredList([session.cleanup(), other_session.cleanup()])
+
+    def test_store_bounded(self):
+        """
+        Test whether a bounded cache is cleared once a new key would exceed its maximum size
+        """
+        registry = {}
+        for key in range(3):
+            session_module._store_bounded(registry, key, key, 3)
+        session_module._store_bounded(registry, 2, "updated", 3)
+        self.assertEqual(registry, {0: 0, 1: 1, 2: "updated"})
+        session_module._store_bounded(registry, 3, 3, 3)
+        self.assertEqual(registry, {3: 3})
+
+    def test_request_rate_limit(self):
+        """
+        Test whether requests to the same tracker are spaced out
+        """
+        session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
+        other_session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
+        http_session = HttpTrackerSession("localhost", ("localhost", 8475), "/announce", 5)
+        self.assertEqual(session.reserve_request_slot(), 0)
+        self.assertAlmostEqual(other_session.reserve_request_slot(), TRACKER_MIN_REQUEST_INTERVAL, places=2)
+        self.assertEqual(http_session.reserve_request_slot(), 0)
+
+        other_session.on_ip_address_resolved("127.0.0.1")
+        self.assertTrue(other_session.is_pending_task_active("connect"))
+        return DeferredList([session.cleanup(), other_session.cleanup(), http_session.cleanup()])
+
+    def test_udpsession_scrape_request(self):
+        sent_messages = []
+        self.socket_mgr.send_request = lambda message, _: sent_messages.append(message)
+        session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
+        session.add_infohash("a" * 20)
+        session.add_infohash("b" * 20)
+        session.action = TRACKER_ACTION_SCRAPE
+        session.send_scrape_request()
+        self.assertEqual(sent_messages, [struct.pack("!qii20s20s", session._connection_id, TRACKER_ACTION_SCRAPE,
+                                                     session.transaction_id, "a" * 20, "b" * 20)])
+        return session.cleanup()
+
     def test_udpsession_handle_connection_wrong_action_transaction(self):
         session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
         session.on_ip_address_resolved("127.0.0.1")
@@ -196,6 +376,7 @@ class TestTorrentCheckerSession(TestAsServer):
         packet = struct.pack("!iiq", 123, 124, 126)
         session.handle_connection_response(packet)
         self.assertFalse(session.is_failed)
+        return session.cleanup()
 
     def test_udpsession_handle_wrong_action_transaction(self):
         session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
@@ -257,6 +438,54 @@ class TestTorrentCheckerSession(TestAsServer):
 
         return session.result_deferred.addCallback(lambda *_: session.cleanup())
 
+    @trial_timeout(5)
+    def test_udpsession_multiple_infohashes(self):
+        session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 5, self.socket_mgr)
+        session.result_deferred = Deferred()
+        session._infohash_list = ["a" * 20, "b" * 20]
+        packet = struct.pack("!iiiiiiii", session.action, session.transaction_id, 1, 2, 3, 4, 5, 6)
+        session.handle_scrape_response(packet)
+
+        def verify_response(response):
+            response_list = response["localhost"]
+            self.assertEqual(len(response_list), 2)
+            self.assertEqual(response_list[0], {'infohash': hexlify("a" * 20), 'seeders': 1, 'leechers': 3})
+            self.assertEqual(response_list[1], {'infohash': hexlify("b" * 20), 'seeders': 4, 'leechers': 6})
+            return session.cleanup()
+
+        return session.result_deferred.addCallback(verify_response)
+
+    def test_udpsession_transaction_ids(self):
+        session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 0, self.socket_mgr)
+        first_transaction_id = session.transaction_id
+        self.assertIn(first_transaction_id, UdpTrackerSession._active_transaction_ids)
+
+        session.generate_transaction_id()
+        self.assertNotIn(first_transaction_id, UdpTrackerSession._active_transaction_ids)
+        self.assertIn(session.transaction_id, UdpTrackerSession._active_transaction_ids)
+
+        session.remove_transaction_id()
+        self.assertNotIn(session, UdpTrackerSession._active_session_dict)
+        self.assertNotIn(session.transaction_id, UdpTrackerSession._active_transaction_ids)
+
+    def test_udp_socket_manager_dispatch(self):
+        """
+        Test whether the UDP socket manager only forwards valid responses to the right tracker session
+        """
+        socket_mgr = UdpSocketManager()
+        responses = []
+        session = MockObject()
+        session.handle_response = responses.append
+        socket_mgr.tracker_sessions[124] = session
+
+        socket_mgr.datagramReceived(struct.pack("!ih", 123, 124), ("127.0.0.1", 4782))
+        self.assertFalse(responses)
+
+        packet = struct.pack("!iiq", 123, 124, 126)
+        socket_mgr.datagramReceived(packet, ("127.0.0.1", 4782))
+        self.assertEqual(responses, [packet])
+        self.assertNotIn(124, socket_mgr.tracker_sessions)
+
     @trial_timeout(5)
     def test_udpsession_on_error(self):
         test_deferred = Deferred()
@@ -266,6 +495,28 @@ class TestTorrentCheckerSession(TestAsServer):
         session.on_error(Failure(RuntimeError("test")))
         return test_deferred
 
+    def test_udpsession_cached_host(self):
+        """
+        Test whether a cached hostname is not resolved again, and whether a cached failure fails the session
+        """
+        UdpTrackerSession._resolved_hosts["localhost"] = ("127.0.0.1", reactor.seconds() + 60, None)
+        session = UdpTrackerSession("localhost", ("localhost", 4782), "/announce", 5, self.socket_mgr)
+        session.connect_to_tracker()
+        self.assertFalse(session.is_pending_task_active("resolve"))
+        self.assertEqual(session.ip_address, "127.0.0.1")
+
+        UdpTrackerSession._resolved_hosts["tracker.invalid"] = (None, reactor.seconds() + 60, "lookup failed")
+        failed_session = UdpTrackerSession("tracker.invalid", ("tracker.invalid", 4782), "/announce", 5,
+                                           self.socket_mgr)
+        errors = []
+        failed_session.connect_to_tracker().addErrback(lambda failure: errors.append(failure.getErrorMessage()))
+        self.assertTrue(failed_session.is_failed)
+        self.assertIn("lookup failed", errors[0])
+
+        UdpTrackerSession.on_host_resolve_failed(Failure(RuntimeError("test")), "other.invalid")
+        self.assertIsNone(UdpTrackerSession._resolved_hosts["other.invalid"][0])
+        return DeferredList([session.cleanup(), failed_session.cleanup()])
+
     @trial_timeout(5)
     def test_big_correct_run(self):
         session = UdpTrackerSession("localhost", ("192.168.1.1", 1234), "/announce", 0, self.socket_mgr)
@@ -286,11 +537,17 @@ class TestTorrentCheckerSession(TestAsServer):
         session = HttpTrackerSession("localhost", ("localhost", 8475), "/announce", 5)
         result_deferred = Deferred()
         session.result_deferred = result_deferred
-        session._infohash_list.append("test")
+        session.add_infohash("test")
+        self.assertTrue(session.has_infohash("test"))
         response = bencode({"files": {"a" * 20: {"complete": 10, "incomplete": 10}}})
         session._process_scrape_response(response)
         self.assertTrue(session.is_finished)
 
+        def verify_response(response):
+            self.assertIn({'infohash': hexlify("test"), 'seeders': 0, 'leechers': 0}, response["localhost"])
+
+        return result_deferred.addCallback(verify_response)
+
     @trial_timeout(5)
     def test_failed_unicode(self):
         test_deferred = Deferred()
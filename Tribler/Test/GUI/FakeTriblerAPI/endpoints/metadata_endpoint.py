@@ -1,14 +1,201 @@
 from __future__ import absolute_import
 
 import json
+import re
 from binascii import unhexlify
 from random import randint, sample
 
+from six import PY2, text_type
+from six.moves import xrange
+
 from twisted.internet import reactor
+from twisted.internet.interfaces import IPullProducer
 from twisted.web import http, resource
 from twisted.web.server import NOT_DONE_YET
 
+from zope.interface import implementer
+
 import Tribler.Test.GUI.FakeTriblerAPI.tribler_utils as tribler_utils
+from Tribler.Test.GUI.FakeTriblerAPI.utils.json_utils import dumps, encode_default
+
+HAS_MSGPACK = True
+try:
+    import msgpack
+except ImportError:
+    HAS_MSGPACK = False
+
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+
+
+def _accepts_msgpack(request):
+    """
+    Returns whether the client asked for a MessagePack response and we are able to produce one.
+    """
+    return HAS_MSGPACK and MSGPACK_CONTENT_TYPE in (request.getHeader("Accept") or "")
+
+
+def _msgpack_response(request, obj):
+    """
+    Serializes a response to MessagePack. On Python 2 text and bytes are the same type, so there everything
+    is packed as raw strings instead of separating text from binary.
+    """
+    request.setHeader("Content-Type", MSGPACK_CONTENT_TYPE)
+    return msgpack.packb(obj, use_bin_type=not PY2)
+
+
+# The fixed responses are serialized once
+SUCCESS_RESPONSE = dumps({"success": True})
+SUBSCRIBE_MISSING_RESPONSE = dumps({"success": False, "error": "subscribe parameter missing"})
+CHANNEL_NOT_FOUND_RESPONSE = dumps({"error": "the channel with the provided cid is not known"})
+TORRENT_NOT_FOUND_RESPONSE = dumps({"error": "the torrent with the specific infohash cannot be found"})
+
+
+# The search term in a filter parameter is the part between the first pair of double quotes
+FILTER_REGEX = re.compile(br'"([^"]*)"')
+
+
+def _unhex(value):
+    """
+    Decodes a hexadecimal public key or infohash from a request.
+    unhexlify already decodes through a lookup table in C, this helper only turns malformed input into None
+    so the endpoints can answer with a 404 instead of an internal server error.
+    """
+    try:
+        return unhexlify(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_bool(value):
+    return bool(int(value))
+
+
+def _parse_text(value):
+    return value.decode('utf-8', 'replace')
+
+
+def _parse_filter(value):
+    match = FILTER_REGEX.search(value)
+    return _parse_text(match.group(1)) if match else None
+
+
+# The query parameters of the paginated endpoints, as (name, converter, default) tuples.
+# Twisted hands us the parameters as bytes: the values that end up in a response or are compared with
+# names (sort_by and filter) are decoded to text here, once, so they can be passed to the JSON encoder as is.
+LIST_PARAMETERS = (
+    (b'first', int, 1),
+    (b'last', int, 50),
+    (b'sort_by', _parse_text, None),
+    (b'sort_asc', _parse_bool, True),
+    (b'filter', _parse_filter, None)
+)
+CHANNELS_PARAMETERS = LIST_PARAMETERS + ((b'subscribed', _parse_bool, False),)
+CHANNEL_TORRENTS_PARAMETERS = LIST_PARAMETERS + ((b'channel', _unhex, ''),)
+
+
+def _parse_parameters(parameters, spec):
+    """
+    Parses the query parameters described by spec in a single pass.
+    :return: A tuple with, for every parameter in spec, the converted value, or the default if the parameter
+             is missing or malformed (such as a first or last that is not an integer).
+    """
+    values = []
+    for name, convert, default in spec:
+        value = default
+        if name in parameters:
+            try:
+                value = convert(parameters[name][0])
+            except ValueError:
+                pass
+        values.append(value)
+    return tuple(values)
+
+
+# The endpoints for dynamic paths (public keys, channel ids and infohashes) are kept around for repeated requests
+MAX_CACHED_CHILDREN = 256
+
+
+def _get_cached_child(children, path, factory):
+    """
+    Returns the endpoint for a dynamic path from the children cache, creating it with factory(path) if needed.
+    """
+    child = children.get(path)
+    if child is None:
+        if len(children) >= MAX_CACHED_CHILDREN:
+            children.clear()
+        child = children[path] = factory(path)
+    return child
+
+
+# The minimum amount of serialized JSON the JSONStreamProducer collects before writing it to the request
+JSON_STREAM_CHUNK_SIZE = 16 * 1024
+
+
+@implementer(IPullProducer)
+class JSONStreamProducer(object):
+    """
+    This class writes a JSON response in chunks of about JSON_STREAM_CHUNK_SIZE bytes, so the reactor is
+    not blocked while a large response is being serialized.
+    The optional prefix and suffix are already serialized bytes that are written around the encoded object,
+    as part of the first and the last write so they do not end up in HTTP chunks of their own.
+    """
+
+    def __init__(self, request, obj, prefix=b"", suffix=b""):
+        self.request = request
+        self._iter = json.JSONEncoder(default=encode_default).iterencode(obj)
+        self._prefix = prefix
+        self._suffix = suffix
+
+    def start(self):
+        """
+        Registers this producer with the request.
+        :return: NOT_DONE_YET, to be returned by the render method.
+        """
+        self.request.registerProducer(self, False)
+        return NOT_DONE_YET
+
+    def resumeProducing(self):
+        if self._iter is None:
+            return
+
+        chunks = []
+        size = len(self._prefix)
+        for chunk in self._iter:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= JSON_STREAM_CHUNK_SIZE:
+                break
+        else:
+            self._iter = None
+
+        data = ''.join(chunks)
+        data = self._prefix + (data.encode('utf-8') if isinstance(data, text_type) else data)
+        self._prefix = b""
+        if self._iter is None:
+            data += self._suffix
+
+        if data:
+            self.request.write(data)
+
+        if self._iter is None:
+            self.request.unregisterProducer()
+            self.request.finish()
+
+    def stopProducing(self):
+        self._iter = None
+
+
+# The envelope of the paginated responses, the results are streamed after it
+LIST_RESPONSE_PREFIX = b'{"first": %d, "last": %d, "sort_by": %s, "sort_asc": %d, "total": %d, "results": '
+
+
+def _list_response(request, results, first, last, sort_by, sort_asc, total):
+    """
+    Writes a paginated response by filling in the envelope template and streaming the results after it.
+    :return: NOT_DONE_YET, to be returned by the render method.
+    """
+    prefix = LIST_RESPONSE_PREFIX % (first, last, json.dumps(sort_by).encode('utf-8'), int(sort_asc), total)
+    return JSONStreamProducer(request, results, prefix=prefix, suffix=b"}").start()
 
 
 class MetadataEndpoint(resource.Resource):
@@ -28,12 +215,14 @@ class MetadataEndpoint(resource.Resource):
 class BaseChannelsEndpoint(resource.Resource):
 
     @staticmethod
-    def return_404(request, message="the channel with the provided cid is not known"):
+    def return_404(request, message=None):
         """
         Returns a 404 response code if your channel has not been created.
         """
         request.setResponseCode(http.NOT_FOUND)
-        return json.dumps({"error": message})
+        if message is None:
+            return CHANNEL_NOT_FOUND_RESPONSE
+        return dumps({"error": message})
 
 
 class ChannelsEndpoint(BaseChannelsEndpoint):
@@ -47,55 +236,38 @@ class ChannelsEndpoint(BaseChannelsEndpoint):
         for path, child_cls in child_handler_dict.items():
             self.putChild(path, child_cls())
 
-    def getChild(self, path, request):
-        if path == "popular":
-            return ChannelsPopularEndpoint()
+        self.channel_endpoints = {}
 
-        return ChannelPublicKeyEndpoint(path)
+    def getChild(self, path, request):
+        return _get_cached_child(self.channel_endpoints, path, ChannelPublicKeyEndpoint)
 
     @staticmethod
     def sanitize_parameters(parameters):
         """
         Sanitize the parameters and check whether they exist
         """
-        first = 1 if 'first' not in parameters else int(parameters['first'][0])  # TODO check integer!
-        last = 50 if 'last' not in parameters else int(parameters['last'][0])  # TODO check integer!
-        sort_by = None if 'sort_by' not in parameters else parameters['sort_by'][0]  # TODO check integer!
-        sort_asc = True if 'sort_asc' not in parameters else bool(int(parameters['sort_asc'][0]))
-        query_filter = None if 'filter' not in parameters else parameters['filter'][0]
-
-        if query_filter:
-            parts = query_filter.split("\"")
-            query_filter = parts[1]
-
-        subscribed = False
-        if 'subscribed' in parameters:
-            subscribed = bool(int(parameters['subscribed'][0]))
-
-        return first, last, sort_by, sort_asc, query_filter, subscribed
+        return _parse_parameters(parameters, CHANNELS_PARAMETERS)
 
     def render_GET(self, request):
         first, last, sort_by, sort_asc, query_filter, subscribed = ChannelsEndpoint.sanitize_parameters(request.args)
         channels, total = tribler_utils.tribler_data.get_channels(first, last, sort_by, sort_asc, query_filter,
                                                                   subscribed)
-        return json.dumps({
-            "results": channels,
-            "first": first,
-            "last": last,
-            "sort_by": sort_by,
-            "sort_asc": int(sort_asc),
-            "total": total
-        })
+        return _list_response(request, channels, first, last, sort_by, sort_asc, total)
 
 
 class ChannelPublicKeyEndpoint(BaseChannelsEndpoint):
 
     def getChild(self, path, request):
-        return SpecificChannelEndpoint(self.channel_pk, path)
+        return _get_cached_child(self.channel_id_endpoints, path,
+                                 lambda channel_id: SpecificChannelEndpoint(self.channel_pk, channel_id))
 
     def __init__(self, path):
         BaseChannelsEndpoint.__init__(self)
-        self.channel_pk = unhexlify(path)
+        self.channel_pk = _unhex(path)
+        self.channel_id_endpoints = {}
+
+
+SUBSCRIBE_BODIES = {b"subscribe=0": False, b"subscribe=1": True}
 
 
 class SpecificChannelEndpoint(resource.Resource):
@@ -108,12 +280,18 @@ class SpecificChannelEndpoint(resource.Resource):
         self.putChild(b"torrents", SpecificChannelTorrentsEndpoint(self.channel_pk, self.channel_id))
 
     def render_POST(self, request):
-        parameters = http.parse_qs(request.content.read(), 1)
-        if 'subscribe' not in parameters:
-            request.setResponseCode(http.BAD_REQUEST)
-            return json.dumps({"success": False, "error": "subscribe parameter missing"})
+        body = request.content.read()
+        # The GUI only ever posts a single subscribe flag, so handle that without parsing the query string
+        if body in SUBSCRIBE_BODIES:
+            to_subscribe = SUBSCRIBE_BODIES[body]
+        else:
+            parameters = http.parse_qs(body, 1)
+            if b'subscribe' not in parameters:
+                request.setResponseCode(http.BAD_REQUEST)
+                return SUBSCRIBE_MISSING_RESPONSE
+
+            to_subscribe = _parse_bool(parameters[b'subscribe'][0])
 
-        to_subscribe = bool(int(parameters['subscribe'][0]))
         channel = tribler_utils.tribler_data.get_channel_with_public_key(self.channel_pk)
         if channel is None:
             return BaseChannelsEndpoint.return_404(request)
@@ -122,11 +300,10 @@ class SpecificChannelEndpoint(resource.Resource):
             tribler_utils.tribler_data.subscribed_channels.add(channel.id)
             channel.subscribed = True
         else:
-            if channel.id in tribler_utils.tribler_data.subscribed_channels:
-                tribler_utils.tribler_data.subscribed_channels.remove(channel.id)
+            tribler_utils.tribler_data.subscribed_channels.discard(channel.id)
             channel.subscribed = False
 
-        return json.dumps({"success": True})
+        return SUCCESS_RESPONSE
 
 
 class SpecificChannelTorrentsEndpoint(BaseChannelsEndpoint):
@@ -141,21 +318,7 @@ class SpecificChannelTorrentsEndpoint(BaseChannelsEndpoint):
         """
         Sanitize the parameters and check whether they exist
         """
-        first = 1 if 'first' not in parameters else int(parameters['first'][0])  # TODO check integer!
-        last = 50 if 'last' not in parameters else int(parameters['last'][0])  # TODO check integer!
-        sort_by = None if 'sort_by' not in parameters else parameters['sort_by'][0]  # TODO check integer!
-        sort_asc = True if 'sort_asc' not in parameters else bool(int(parameters['sort_asc'][0]))
-        query_filter = None if 'filter' not in parameters else parameters['filter'][0]
-
-        channel = ''
-        if 'channel' in parameters:
-            channel = unhexlify(parameters['channel'][0])
-
-        if query_filter:
-            parts = query_filter.split("\"")
-            query_filter = parts[1]
-
-        return first, last, sort_by, sort_asc, query_filter, channel
+        return _parse_parameters(parameters, CHANNEL_TORRENTS_PARAMETERS)
 
     def render_GET(self, request):
         first, last, sort_by, sort_asc, query_filter, channel = SpecificChannelTorrentsEndpoint.sanitize_parameters(
@@ -165,44 +328,47 @@ class SpecificChannelTorrentsEndpoint(BaseChannelsEndpoint):
             return SpecificChannelTorrentsEndpoint.return_404(request)
 
         torrents, total = tribler_utils.tribler_data.get_torrents(first, last, sort_by, sort_asc, query_filter, channel)
-        return json.dumps({
-            "results": torrents,
-            "first": first,
-            "last": last,
-            "sort_by": sort_by,
-            "sort_asc": int(sort_asc),
-            "total": total
-        })
+        return _list_response(request, torrents, first, last, sort_by, sort_asc, total)
 
 
 class ChannelsPopularEndpoint(BaseChannelsEndpoint):
 
-    def render_GET(self, _request):
-        results_json = [channel.get_json() for channel in sample(tribler_utils.tribler_data.channels, 20)]
-        return json.dumps({"channels": results_json})
+    def render_GET(self, request):
+        channels = tribler_utils.tribler_data.channels
+        indices = sample(xrange(len(channels)), 20)
+        if _accepts_msgpack(request):
+            return _msgpack_response(request, {"channels": [channels[index].get_msgpack() for index in indices]})
+
+        return b'{"channels": [' + b', '.join(channels[index].get_json_bytes() for index in indices) + b']}'
 
 
 class TorrentsEndpoint(resource.Resource):
 
-    def getChild(self, path, request):
-        if path == "random":
-            return TorrentsRandomEndpoint()
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.putChild("random", TorrentsRandomEndpoint())
+        self.torrent_endpoints = {}
 
-        return SpecificTorrentEndpoint(path)
+    def getChild(self, path, request):
+        return _get_cached_child(self.torrent_endpoints, path, SpecificTorrentEndpoint)
 
 
 class TorrentsRandomEndpoint(resource.Resource):
 
-    def render_GET(self, _request):
-        return json.dumps({"torrents": [torrent.get_json()
-                                        for torrent in sample(tribler_utils.tribler_data.torrents, 20)]})
+    def render_GET(self, request):
+        torrents = tribler_utils.tribler_data.torrents
+        indices = sample(xrange(len(torrents)), 20)
+        if _accepts_msgpack(request):
+            return _msgpack_response(request, {"torrents": [torrents[index].get_msgpack() for index in indices]})
+
+        return b'{"torrents": [' + b', '.join(torrents[index].get_json_bytes() for index in indices) + b']}'
 
 
 class SpecificTorrentEndpoint(resource.Resource):
 
     def __init__(self, infohash):
         resource.Resource.__init__(self)
-        self.infohash = unhexlify(infohash)
+        self.infohash = _unhex(infohash)
 
         self.putChild("health", SpecificTorrentHealthEndpoint(self.infohash))
 
@@ -210,9 +376,13 @@ class SpecificTorrentEndpoint(resource.Resource):
         torrent = tribler_utils.tribler_data.get_torrent_with_infohash(self.infohash)
         if not torrent:
             request.setResponseCode(http.NOT_FOUND)
-            return json.dumps({"error": "the torrent with the specific infohash cannot be found"})
+            return TORRENT_NOT_FOUND_RESPONSE
+
+        return dumps({"torrent": torrent.get_json(include_trackers=True)})
+
 
-        return json.dumps({"torrent": torrent.get_json(include_trackers=True)})
+# The health response only contains two integers, so it is formatted directly instead of going through an encoder
+HEALTH_RESPONSE_TEMPLATE = b'{"health": {"DHT": {"seeders": %d, "leechers": %d}}}'
 
 
 class SpecificTorrentHealthEndpoint(resource.Resource):
@@ -225,19 +395,12 @@ class SpecificTorrentHealthEndpoint(resource.Resource):
         torrent = tribler_utils.tribler_data.get_torrent_with_infohash(self.infohash)
         if not torrent:
             request.setResponseCode(http.NOT_FOUND)
-            return json.dumps({"error": "the torrent with the specific infohash cannot be found"})
+            return TORRENT_NOT_FOUND_RESPONSE
 
         def update_health():
             if not request.finished:
                 torrent.update_health()
-                request.write(json.dumps({
-                    "health": {
-                        "DHT": {
-                            "seeders": torrent.num_seeders,
-                            "leechers": torrent.num_leechers
-                        }
-                    }
-                }))
+                request.write(HEALTH_RESPONSE_TEMPLATE % (torrent.num_seeders, torrent.num_leechers))
                 request.finish()
 
         reactor.callLater(randint(0, 5), update_health)
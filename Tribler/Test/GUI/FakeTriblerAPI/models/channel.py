@@ -7,6 +7,7 @@ from random import choice, randint
 import Tribler.Test.GUI.FakeTriblerAPI.tribler_utils as tribler_utils
 from Tribler.Test.GUI.FakeTriblerAPI.constants import NEW, TODELETE
 from Tribler.Test.GUI.FakeTriblerAPI.utils import get_random_hex_string
+from Tribler.Test.GUI.FakeTriblerAPI.utils.json_utils import dumps
 from Tribler.pyipv8.ipv8.util import old_round
 
 
@@ -22,6 +23,8 @@ class Channel(object):
         self.subscribed = False
         self.state = choice([u"Downloading", u"Personal", u"Legacy", u"Complete", u"Updating", u"Preview"])
         self.timestamp = int(old_round(time.time() * 1000)) - randint(0, 3600 * 24 * 7 * 1000)
+        # the serialized JSON of this channel, together with the (name, subscribed, number of torrents) it was made for
+        self._json_cache = None
 
         self.add_random_torrents()
 
@@ -44,6 +47,23 @@ class Channel(object):
             "updated": self.timestamp
         }
 
+    def get_msgpack(self):
+        """
+        Returns the fields of get_json, with the raw public key instead of its hexadecimal representation.
+        """
+        result = self.get_json()
+        result["public_key"] = self.public_key
+        return result
+
+    def get_json_bytes(self):
+        """
+        Returns the output of get_json serialized to JSON, which is cached until the channel changes.
+        """
+        cache_key = (self.name, self.subscribed, len(self.torrents))
+        if self._json_cache is None or self._json_cache[0] != cache_key:
+            self._json_cache = (cache_key, dumps(self.get_json()))
+        return self._json_cache[1]
+
     def get_torrent_with_infohash(self, infohash):
         for torrent in self.torrents:
             if torrent.infohash == infohash:
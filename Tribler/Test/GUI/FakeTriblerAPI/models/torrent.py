@@ -8,6 +8,7 @@ from six.moves import xrange
 
 from Tribler.Test.GUI.FakeTriblerAPI.constants import COMMITTED
 from Tribler.Test.GUI.FakeTriblerAPI.utils import get_random_filename, get_random_hex_string
+from Tribler.Test.GUI.FakeTriblerAPI.utils.json_utils import dumps
 
 
 class Torrent(object):
@@ -25,6 +26,8 @@ class Torrent(object):
         self.last_tracker_check = 0
         self.num_seeders = 0
         self.num_leechers = 0
+        # the serialized JSON of this torrent, cleared when the health changes
+        self._json_cache = None
 
         if randint(0, 1) == 0:
             # Give this torrent some health
@@ -37,6 +40,7 @@ class Torrent(object):
         self.last_tracker_check = randint(int(time.time()) - 3600 * 24 * 30, int(time.time()))
         self.num_seeders = randint(0, 500) if randint(0, 1) == 0 else 0
         self.num_leechers = randint(0, 500) if randint(0, 1) == 0 else 0
+        self._json_cache = None
 
     def get_json(self, include_status=False, include_trackers=False):
         result = {
@@ -58,6 +62,22 @@ class Torrent(object):
 
         return result
 
+    def get_msgpack(self):
+        """
+        Returns the fields of get_json, with the raw infohash instead of its hexadecimal representation.
+        """
+        result = self.get_json()
+        result["infohash"] = self.infohash
+        return result
+
+    def get_json_bytes(self):
+        """
+        Returns the output of get_json (without status and trackers) serialized to JSON.
+        """
+        if self._json_cache is None:
+            self._json_cache = dumps(self.get_json())
+        return self._json_cache
+
     @staticmethod
     def random():
         infohash = unhexlify(get_random_hex_string(40))
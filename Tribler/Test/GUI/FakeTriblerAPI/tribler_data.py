@@ -27,6 +27,9 @@ class TriblerData(object):
         self.channels = []
         self.torrents = []
         self.subscribed_channels = set()
+        # Channels and torrents found by public key and infohash. They are never removed, so hits can be cached.
+        self.channels_by_public_key = {}
+        self.torrents_by_infohash = {}
         self.downloads = []
         self.my_channel = -1
         self.settings = {}
@@ -199,10 +202,13 @@ class TriblerData(object):
         return None
 
     def get_channel_with_public_key(self, public_key):
-        for channel in self.channels:
-            if str(channel.public_key) == public_key:
-                return channel
-        return None
+        channel = self.channels_by_public_key.get(public_key)
+        if channel is None:
+            for candidate in self.channels:
+                if str(candidate.public_key) == public_key:
+                    channel = self.channels_by_public_key[public_key] = candidate
+                    break
+        return channel
 
     def get_my_channel(self):
         if self.my_channel == -1:
@@ -216,10 +222,13 @@ class TriblerData(object):
         return None
 
     def get_torrent_with_infohash(self, infohash):
-        for torrent in self.torrents:
-            if torrent.infohash == infohash:
-                return torrent
-        return None
+        torrent = self.torrents_by_infohash.get(infohash)
+        if torrent is None:
+            for candidate in self.torrents:
+                if candidate.infohash == infohash:
+                    torrent = self.torrents_by_infohash[infohash] = candidate
+                    break
+        return torrent
 
     def start_random_download(self, media=False):
         random_torrent = Torrent.random()
@@ -0,0 +1,28 @@
+from __future__ import absolute_import
+
+import json
+
+HAS_ORJSON = True
+try:
+    import orjson
+except ImportError:
+    HAS_ORJSON = False
+
+
+def encode_default(obj):
+    """
+    Encodes the objects the JSON encoders do not know about, which are the byte strings (such as hexlified keys)
+    on Python 3.
+    """
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+def dumps(obj):
+    """
+    Serializes an object to JSON bytes, using orjson if it is available.
+    """
+    if HAS_ORJSON:
+        return orjson.dumps(obj, default=encode_default)
+    return json.dumps(obj, default=encode_default).encode('utf-8')